@@ -8,12 +8,43 @@
 
 # Modules Import
 import os
+import re
 import inspect
 
-from substance_painter import export, textureset, resource, layerstack
+from substance_painter import export, textureset, resource, layerstack, logging
 from vg_pt_utils import vg_layerstack
 
 
+# Source modification time of this module when it was loaded, compared by the plugins to reload it
+_LOADED_MTIME = os.path.getmtime(__file__)
+
+
+# Channel types resolved once, indexed by their name as found in exported file names
+_CHANNEL_TYPES = {channel_type.name: channel_type for channel_type in layerstack.ChannelType}
+
+# Channel name of an exported texture path (e.g. "mesh_textureSet_BaseColor.1001.png" -> "BaseColor")
+_CHANNEL_RE = re.compile(r"_(?P<channel>[^_/\\.]+)[^_/\\]*\.png$", re.IGNORECASE)
+
+# RGBA channels description of an exported document map, completed with the map name
+_RGBA_CHANNEL_TEMPLATE = tuple(
+    {"destChannel": channel, "srcChannel": channel, "srcMapType": "DocumentMap"}
+    for channel in "RGBA"
+)
+
+# File parameters shared by every exported document map
+_MAP_EXPORT_PARAMETERS = {"bitDepth": "8", "dithering": False, "fileFormat": "png"}
+
+
+def _get_channel_type(texture_path):
+    """Returns the channel type an exported texture path is meant for, or None if it can't be found"""
+    channel_match = _CHANNEL_RE.search(texture_path)
+    if not channel_match:
+        return None
+
+    channel_type_string = channel_match.group("channel")
+    return _CHANNEL_TYPES.get(channel_type_string)
+
+
 class VG_ExportManager:
     """
     A manager gathering different features related to export in Substance 3D Painter.
@@ -26,6 +57,9 @@ class VG_ExportManager:
     get_export_preset():
         Obtains the URL of the specified export preset.
 
+    invalidate_preset():
+        Clears the cached export preset URL, to be called after changing export_preset_name.
+
     get_textureset_info():
         Returns texture set information related to a stack (object, name, UV tiles coordinates) in a dictionary.
 
@@ -46,39 +80,46 @@ class VG_ExportManager:
     def __init__(self, export_path = default_export_path, export_preset_name = ""):
         self.export_path = export_path  # Define the export path
         self.export_preset_name = export_preset_name  # Define the export preset name
+        self._export_preset_url = None  # Cached URL of the export preset
+        self._channels_maps_cache = {}  # Export maps, indexed by the tuple of channel names they were built for
 
     def get_export_preset(self):
         """
             Obtains the URL of the specified export preset.
+            The URL is cached on the instance after the first successful lookup.
     
             Returns:
             str or None: The URL of the export preset, or None if an error occurs.
         """
+        if self._export_preset_url is not None:
+            return self._export_preset_url
+
         try:
             export_preset = resource.ResourceID(
                 context="starter_assets", name=self.export_preset_name
             )
-            return export_preset.url()
+            self._export_preset_url = export_preset.url()
+            return self._export_preset_url
 
         except resource.ResourceError as e:
-            print(f"Error obtaining export preset: {e}")
+            logging.error(f"Error obtaining export preset: {e}")
             return None
 
+    def invalidate_preset(self):
+        """Clears the cached export preset URL, so it is looked up again after export_preset_name changes"""
+        self._export_preset_url = None
+
     def get_textureset_info(self):
         """Returns Texture set related to a stack, and it's name into a dictionary
-        If no argument, the current stack will be used to generate the information"""
+        If no argument, the current stack will be used to generate the information."""
 
         target_stack = textureset.get_active_stack()
         target_textureset = target_stack.material()  # textureSet Object
-        texture_set_name = str(target_stack.material())  # textureSet Name
+        texture_set_name = str(target_textureset)  # textureSet Name, without a second material() call
         texture_set_channels = target_stack.all_channels()
 
         # Generate UV tiles coordonates list
-        uv_tiles_list = target_textureset.all_uv_tiles()
-        uv_tiles_coordinates_list = []
-        for tile in uv_tiles_list:
-            coordinates = [tile.u, tile.v]
-            uv_tiles_coordinates_list.append(coordinates)
+        uv_tiles_coordinates_list = [(tile.u, tile.v) for tile in target_textureset.all_uv_tiles()]
 
         # Generate info dictionary
         textureset_info = {
@@ -90,55 +131,57 @@ class VG_ExportManager:
 
         return textureset_info
 
+
    
-    def generate_current_channels_maps_export(self):
-    # Get Active TextureSet info:
-        current_textureset_info = self.get_textureset_info()
+    def generate_current_channels_maps_export(self, current_textureset_info=None):
+        """Returns the export maps of the channels of the active texture set.
+        An already fetched texture set information can be given to avoid fetching it again"""
+        # Get Active TextureSet info:
+        if current_textureset_info is None:
+            current_textureset_info = self.get_textureset_info()
         raw_channels_list = current_textureset_info["Channels"]
-        channels_names = []
-        current_channels_info = []
 
-        for element in raw_channels_list:
-            channels_names.append(element.name)
+        channels_names = tuple(element.name for element in raw_channels_list)
 
-        for channel_name in channels_names:            
+        # Maps only depend on the channel names, so they are built once per channel set
+        current_channels_maps = self._channels_maps_cache.get(channels_names)
+        if current_channels_maps is None:
+            current_channels_maps = list(self._iter_current_channels_maps_export(channels_names))
+            self._channels_maps_cache[channels_names] = current_channels_maps
+
+        return current_channels_maps
+
+
+    def _iter_current_channels_maps_export(self, channels_names):
+        """Yields one export map configuration per channel name"""
+        for channel_name in channels_names:
             channels_info = [
-                                {
-                                    "destChannel": channel,
-                                    "srcChannel": channel,
-                                    "srcMapType": "DocumentMap",
-                                    "srcMapName": channel_name
-                                } for channel in "RGBA"
-                            ]
-                
-            current_filename = '$mesh_$textureSet_' + channel_name + ".$udim"
-            current_channels_info.append({
+                {**channel_template, "srcMapName": channel_name}
+                for channel_template in _RGBA_CHANNEL_TEMPLATE
+            ]
+
+            current_filename = f"$mesh_$textureSet_{channel_name}.$udim"
+            yield {
                 'fileName': current_filename,
                 'channels': channels_info,
-                'parameters': {
-                    'bitDepth': '8',
-                    'dithering': False,
-                    'fileFormat': 'png'
-                }
-            })
-
-        return current_channels_info
-
+                'parameters': dict(_MAP_EXPORT_PARAMETERS)
+            }
 
         
     
 
     def generate_export_config(self):
+        """Returns the export configuration of the active texture set"""
+        # Get Active TextureSet info:
+        current_textureset_info = self.get_textureset_info()
+
         #export_preset_ref = self.get_export_preset()
         export_preset_name = "Current channels Export"
         
         current_channels_export_preset = {
             "name": export_preset_name,
-            "maps": self.generate_current_channels_maps_export()
+            "maps": self.generate_current_channels_maps_export(current_textureset_info)
         }
-                
-        # Get Active TextureSet info:
-        current_textureset_info = self.get_textureset_info()
         
         # Configure the export settings
         export_config = {
@@ -152,6 +195,7 @@ class VG_ExportManager:
             ],
             "uvTiles": current_textureset_info["UV Tiles coordinates"],
         }
+
         return export_config
     
     
@@ -166,79 +210,83 @@ class VG_ExportManager:
             export_result = export.export_project_textures(export_config)
 
             if export_result.status == export.ExportStatus.Error:
-                print("Error during texture export:", export_result.message)
+                logging.error(f"Error during texture export: {export_result.message}")
                 return None
             else:
-                print("Export successful!")    
+                logging.info("Export successful!")
                 return export_result
 
         except Exception as e:
-            print(f"Error during texture export: {e}")
+            logging.error(f"Error during texture export: {e}")
             return None
         
         
         
 
-    def import_textures_to_layer(self, textures_to_import):
-
+    def import_textures_to_layer(self, textures_to_import, delete_stack_content=False):
+        """Imports the exported textures into a new fill layer on top of the active stack.
+        If delete_stack_content is True, the stack content is deleted first, in the same stack modification"""
         
         if not textures_to_import:
-            print("No textures to import.")
+            logging.warning("No textures to import.")
             return
 
-        # Create a new fill layer in the active texture set
-        current_stack_manager = vg_layerstack.VG_StackManager()
-        new_layer = current_stack_manager.add_layer("fill", layer_position="On Top")
-        new_layer.set_name("Stack layer")
-        new_channel_set = new_layer.active_channels
-        new_layer.active_channels = set(new_channel_set)
-        
-        
-        #Switching all layer channels to "Normal" blending mode
-        for new_layer_channel in new_layer.active_channels:
-            normal_blending = layerstack.BlendingMode(2)
-            new_layer.set_blending_mode(normal_blending, new_layer_channel)
-            
-            
-
-        # Import and assign textures to the new fill layer
-        texture_resource = None
-        for texture_list_key in textures_to_import.textures.keys():
-            current_texture_list = textures_to_import.textures[texture_list_key]
-
+        # Import textures, each path only once, and collect the channels they are assigned to
+        texture_identifiers = {}
+        channel_sources = []
+        for current_texture_list in textures_to_import.textures.values():
             for texture_path in current_texture_list:
-                texture_resource = resource.import_project_resource(
-                    texture_path, resource.Usage.TEXTURE
-                )
-
-                # Get the target channel type
-                last_underscore_index = texture_path.rfind("_")
-                extension_index = texture_path.rfind(".png")
-                if last_underscore_index != -1 and extension_index != -1:
-                    channel_type_string = texture_path[
-                        last_underscore_index + 1 : extension_index
-                    ]
-                    channel_type_string = channel_type_string.split(".")[0]
-
-                    #if channel_type_string != "Normal":
-                    channel_type = getattr(
-                        layerstack.ChannelType, channel_type_string
-                    )
-                    new_layer.set_source(
-                        channel_type, texture_resource.identifier()
-                    )
-
-        print("Textures imported and assigned to the new fill layer.")
+                # Get the target channel type from the file name, before importing anything
+                channel_type = _get_channel_type(texture_path)
+                if channel_type is None:
+                    continue
+
+                texture_identifier = texture_identifiers.get(texture_path)
+                if texture_identifier is None:
+                    texture_identifier = resource.import_project_resource(
+                        texture_path, resource.Usage.TEXTURE
+                    ).identifier()
+                    texture_identifiers[texture_path] = texture_identifier
+
+                channel_sources.append((channel_type, texture_identifier))
+
+        # Don't create an empty layer when the export produced nothing to assign
+        if not channel_sources:
+            logging.warning("No textures to import.")
+            return
 
+        # Group the stack deletion, the layer creation and the texture assignments into a single stack modification
+        with layerstack.ScopedModification("Stack layer"):
+            current_stack_manager = vg_layerstack.VG_StackManager()
+            # Only delete the stack content once there is a replacement layer to create
+            if delete_stack_content:
+                current_stack_manager.delete_stack_content()
 
-if __name__ == "__main__":    
+            # Create a new fill layer in the active texture set
+            new_layer = current_stack_manager.add_layer("fill", layer_position="On Top", skip_refresh=True)
+            new_layer.set_name("Stack layer")
 
-    exporter = VG_ExportManager()
-    exported_textures = exporter.export_active_texture_set()
+            #Switching all layer channels to "Normal" blending mode
+            normal_blending = layerstack.BlendingMode(2)
+            for new_layer_channel in new_layer.active_channels:
+                new_layer.set_blending_mode(normal_blending, new_layer_channel)
 
-    if exported_textures:
-        exporter.import_textures_to_layer(exported_textures)
+            # Assign the imported textures to the new fill layer
+            for channel_type, texture_identifier in channel_sources:
+                new_layer.set_source(channel_type, texture_identifier)
 
+        logging.info(f"{len(texture_identifiers)} textures imported and assigned to the new fill layer.")
 
 
+def create_layer_from_stack(flatten=False, exporter=None):
+    """Exports what is visible in the active stack and imports it back as a new fill layer.
+    If flatten is True, the stack content is deleted before the new layer is created.
+    An existing exporter can be given to reuse its cached export preset and maps"""
+    if exporter is None:
+        exporter = VG_ExportManager()
+    exported_textures = exporter.export_active_texture_set()
+    exporter.import_textures_to_layer(exported_textures, delete_stack_content=flatten)
 
+
+if __name__ == "__main__":    
+    create_layer_from_stack()
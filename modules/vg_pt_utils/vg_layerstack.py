@@ -15,9 +15,59 @@ __author__ = "Vincent GAULT - Adobe"
 
 
 # Modules Import
+import os
+
 from substance_painter import textureset, layerstack, project, resource, logging
 
 
+# Source modification time of this module when it was loaded, compared by the plugins to reload it
+_LOADED_MTIME = os.path.getmtime(__file__)
+
+
+# Channel types resolved once, indexed by their name
+_CHANNEL_TYPES = {channel_type.name: channel_type for channel_type in textureset.ChannelType}
+
+# Resolved channel types sets, indexed by the tuple of channel names they were built from
+_CHANNEL_SET_CACHE = {}
+
+# Layer insertion functions and default names, indexed by the add_layer layer_type they handle
+_LAYER_INSERTERS = {
+    'fill': (layerstack.insert_fill, "New Fill layer"),
+    'paint': (layerstack.insert_paint, "New Paint layer"),
+}
+
+# Insert position builders, from the current stack and layer selection,
+# indexed by the add_layer layer_position they handle
+_INSERT_POSITION_BUILDERS = {
+    # Insert a layer above the selected layer
+    "Above": lambda stack, selection: layerstack.InsertPosition.above_node(selection[0]),
+    # Insert at the top of the given textureset layer stack
+    "On Top": lambda stack, selection: layerstack.InsertPosition.from_textureset_stack(stack),
+}
+
+# Mask backgrounds, indexed by the color name add_mask accepts
+_MASK_COLOR_MAP = {
+    'Black': layerstack.MaskBackground.Black,
+    'White': layerstack.MaskBackground.White,
+}
+
+# Opposite background of each mask background, used to invert masks
+_INVERTED_MASK_BACKGROUND = {
+    layerstack.MaskBackground.Black: layerstack.MaskBackground.White,
+    layerstack.MaskBackground.White: layerstack.MaskBackground.Black,
+}
+
+
+def _resolve_channels(channels_names):
+    """Returns the frozenset of channel types matching the given channel names, built once per names tuple"""
+    channels_key = tuple(channels_names)
+    channels_set = _CHANNEL_SET_CACHE.get(channels_key)
+    if channels_set is None:
+        channels_set = frozenset(_CHANNEL_TYPES[channel] for channel in channels_key)
+        _CHANNEL_SET_CACHE[channels_key] = channels_set
+    return channels_set
+
+
 class VG_StackManager:
     
     """
@@ -38,10 +88,16 @@ class VG_StackManager:
     ### `__init__()`
     Initializes the `VG_StackManager` class and sets the current active texture stack if a project is open.
 
-    ### `add_layer(layer_type, active_channels=None)`
+    ### `add_layer(layer_type, active_channels=None, layer_position="Above", skip_refresh=False)`
     Adds a layer of the specified type to the current texture stack. The user can specify which channels should be active for the new layer.
     - `layer_type` (str): The type of layer to add (`'fill'` or `'paint'`).
     - `active_channels` (list, optional): A list of channel names to activate for the new layer. If not provided, all channels in the current stack will be activated.
+    - `layer_position` (str, optional): `'Above'` the selected layer (default) or `'On Top'` of the stack.
+    - `skip_refresh` (bool, optional): If True, uses the cached layer selection instead of reading it again.
+
+    ### `batch_add_layers(layers_specs)`
+    Adds several layers in a single layer stack modification, so they are refreshed and undone at once.
+    - `layers_specs` (list): A list of dictionaries of `add_layer` arguments. An optional `'mask'` key gives the mask color (`'Black'` or `'White'`) to add to the new layer.
 
     ### `set_active_channels(layer, channels)`
     Sets the active channels for a given layer.
@@ -62,15 +118,20 @@ class VG_StackManager:
     manager.add_mask()
     """
     
-    
+    # Generator resources identifiers, indexed by their search query
+    _generator_identifiers = {}
 
     def __init__(self):
         """Class Initiaization"""
-        
+        self.refresh()
+
+    def refresh(self):
+        """Reads the active stack and layer selection again and clears the cached stack information,
+        so a single manager can be reused across several operations"""
         self._current_stack = None
         self._layer_selection = None
         self._stack_layers = None
-        self._stack_layers_count = None
+        self._stack_channels = None
         
         if project.is_open():
             self._current_stack = textureset.get_active_stack()
@@ -83,6 +144,7 @@ class VG_StackManager:
     @current_stack.setter
     def current_stack(self, value):
         self._current_stack = value
+        self._stack_channels = None
         
         
     @property
@@ -100,84 +162,99 @@ class VG_StackManager:
             self._stack_layers = layerstack.get_root_layer_nodes(self._current_stack)
         return self._stack_layers
     
+    @property
+    def stack_channels(self):
+        """Channels of the current stack, fetched once per stack"""
+        if self._stack_channels is None:
+            self._stack_channels = frozenset(self._current_stack.all_channels())
+        return self._stack_channels
+    
     @property
     def stack_layers_count(self):
-        if self._stack_layers_count is None:
-            self._stack_layers_count = len(self.stack_layers)
-        return self._stack_layers_count
+        # stack_layers is itself cached, so the count doesn't need its own cache
+        return len(self.stack_layers)
     
     
     
+    def _invalidate_layer_cache(self):
+        """Clears the cached root layers, to be called after the stack content changed"""
+        self._stack_layers = None
+
     def refresh_layer_selection(self):
         self.layer_selection = layerstack.get_selected_nodes(self.current_stack)      
 
+    def _get_generator_identifier(self, search_query):
+        """Returns the identifier of the first resource found for the search query.
+        The result is cached, as starter assets generators don't change during a session.
+        Returns None if no resource is found"""
+        generator_identifier = self._generator_identifiers.get(search_query)
+        if generator_identifier is None:
+            found_resources = resource.search(search_query)
+            if not found_resources:
+                # Not cached, so the search is tried again next time
+                logging.error(f"No resource found for '{search_query}'")
+                return None
+
+            generator_identifier = found_resources[0].identifier()
+            self._generator_identifiers[search_query] = generator_identifier
+        return generator_identifier
+
         
         
         
     
     
-    def add_layer(self, layer_type, active_channels=None, layer_position="Above"):
-        """Add a layer of specified type to the current stack with optional active channels"""
+    def add_layer(self, layer_type, active_channels=None, layer_position="Above", skip_refresh=False):
+        """Add a layer of specified type to the current stack with optional active channels.
+        The layer selection is read again first, unless skip_refresh is True: callers adding several layers
+        in a row, or whose manager was just created or refreshed, can skip this query"""
         
-        if layer_position not in ["Above", "On Top"]:
+        insert_position_builder = _INSERT_POSITION_BUILDERS.get(layer_position)
+        if insert_position_builder is None:
             logging.error("layer_position parameter must be 'Above' or 'On Top'")
             return None        
-        
-        current_layer_count = self._stack_layers_count
-                  
+
+        layer_inserter = _LAYER_INSERTERS.get(layer_type)
+        if layer_inserter is None:
+            logging.error("Invalid layer type")
+            return None
         
         if self._current_stack is None:
             logging.error("No active stack found")
             return None
         
         else:
-            insert_position = None
-            selected_layer = layerstack.get_selected_nodes(self._current_stack)
+            # Read through the property so the root layers are counted on first use
+            current_layer_count = self.stack_layers_count
+            if not skip_refresh:
+                self.refresh_layer_selection()
+            selected_layer = self._layer_selection
             
             if current_layer_count == 0:
                 # Insert at the top of the given textureset layer stack
                 insert_position = layerstack.InsertPosition.from_textureset_stack(self._current_stack)
-                
-            elif layer_position == "Above":
-                # Insert a layer above new_layer                
-                insert_position = layerstack.InsertPosition.above_node(selected_layer[0])
-                
-            elif layer_position == "On Top":
-              # Insert at the top of the given textureset layer stack
-                insert_position = layerstack.InsertPosition.from_textureset_stack(self._current_stack)
-                
-            
-            
+            else:
+                insert_position = insert_position_builder(self._current_stack, selected_layer)
             
             # if len(selected_layer) ==0:
             #     insert_position = layerstack.InsertPosition.from_textureset_stack(self._current_stack)
               
-               
-            new_layer = None           
-            
-            
-            if layer_type == 'fill':                
-                new_layer = layerstack.insert_fill(insert_position)
-                new_layer.set_name("New Fill layer")
-                
+            insert_function, layer_name = layer_inserter
+            new_layer = insert_function(insert_position)
+            new_layer.set_name(layer_name)
 
-            elif layer_type == 'paint':
-                new_layer = layerstack.insert_paint(insert_position)
-                new_layer.set_name("New Paint layer")
-                
-            else:
-                logging.error("Invalid layer type")
-                return
+            # The cached root layers no longer match the stack
+            self._invalidate_layer_cache()
             
             # Set active channels if provided
             if active_channels:
-                new_layer.active_channels = {getattr(textureset.ChannelType, channel) for channel in active_channels}
+                new_layer.active_channels = set(_resolve_channels(active_channels))
             else:
-                active_channels = self._current_stack.all_channels()
-                new_layer.active_channels = set(active_channels)
+                new_layer.active_channels = set(self.stack_channels)
 
             # Select newly created layer
             layerstack.set_selected_nodes([new_layer])
+            self._layer_selection = [new_layer]
             
             return new_layer if new_layer else None
 
@@ -185,79 +262,122 @@ class VG_StackManager:
         
     
     
+    def batch_add_layers(self, layers_specs):
+        """Adds several layers in a single layer stack modification.
+        Each spec is a dictionary of `add_layer` arguments, with an optional 'mask' key giving the mask color to add.
+        Returns the list of created layers"""
+
+        new_layers = []
+        if self.current_stack:
+            self.refresh_layer_selection()
+
+        with layerstack.ScopedModification("Add layers"):
+            for layer_specs in layers_specs:
+                layer_arguments = dict(layer_specs)
+                mask_bkg_color = layer_arguments.pop("mask", None)
+                # The selection was read once above, and each new layer becomes the selection
+                layer_arguments.setdefault("skip_refresh", True)
+
+                new_layer = self.add_layer(**layer_arguments)
+                if new_layer is None:
+                    continue
+
+                # The new layer is selected, so the mask is added to it
+                if mask_bkg_color:
+                    self.add_mask(mask_bkg_color)
+                new_layers.append(new_layer)
+
+        return new_layers
+
+    
+    
     def add_mask(self, mask_bkg_color=None):
         """Adds a mask to the currently selected layer. 
         - If mask_bkg_color is specified, it applies the specified color (Black or White).
+          An existing mask that already has this color is kept as is, with its content.
         - If mask_bkg_color is not specified and no mask is present, Black is chosen.
         - If mask_bkg_color is not specified and a mask is present, the existing mask is inverted."""
         
-        color_map = {
-            'Black': layerstack.MaskBackground.Black,  
-            'White': layerstack.MaskBackground.White  
-        }
-
-        if mask_bkg_color and mask_bkg_color not in color_map:
+        if mask_bkg_color and mask_bkg_color not in _MASK_COLOR_MAP:
             logging.error("Invalid mask color. Choose 'Black' or 'White'.")
             return
 
         # self._current_stack = textureset.get_active_stack()
         if self.current_stack:
-            current_layer = layerstack.get_selected_nodes(self.current_stack)
+            current_layer = self.layer_selection
+            # Nothing selected, nothing to mask
+            if not current_layer:
+                return
+
+            self._add_mask_to(current_layer, mask_bkg_color)
+
 
-            for selectedLayer in current_layer:
-                if selectedLayer.has_mask():  
-                    if mask_bkg_color:
-                        # If a mask is present and a color is specified, remove the existing mask and add the specified color
+    def _add_mask_to(self, layers, mask_bkg_color=None, keep_same_color=True):
+        """Adds a mask to the given layers, following the same rules as add_mask.
+        mask_bkg_color is expected to be already validated.
+        If keep_same_color is False, an existing mask of the specified color is replaced as well"""
+        # Resolved once for all the layers
+        mask_background = _MASK_COLOR_MAP.get(mask_bkg_color)
+        mask_to_add = _MASK_COLOR_MAP.get(mask_bkg_color, layerstack.MaskBackground.Black)
+
+        for selectedLayer in layers:
+            if selectedLayer.has_mask():  
+                if mask_bkg_color:
+                    # If a mask is present and a color is specified, replace the existing mask with the specified color,
+                    # unless it already has this color and may be kept
+                    if not keep_same_color or selectedLayer.get_mask_background() != mask_background:
                         selectedLayer.remove_mask()  
-                        selectedLayer.add_mask(color_map[mask_bkg_color]) 
-                    else:
-                        # If no mask color is specified, invert the existing mask
-                        current_mask_background = selectedLayer.get_mask_background()
-                        new_mask_background = (layerstack.MaskBackground.White if current_mask_background == layerstack.MaskBackground.Black 
-                                            else layerstack.MaskBackground.Black)
-                        selectedLayer.remove_mask()
-                        selectedLayer.add_mask(new_mask_background)
+                        selectedLayer.add_mask(mask_background) 
                 else:
-                    mask_to_add = color_map.get(mask_bkg_color, layerstack.MaskBackground.Black)
-                    selectedLayer.add_mask(mask_to_add)
+                    # If no mask color is specified, invert the existing mask
+                    new_mask_background = _INVERTED_MASK_BACKGROUND[selectedLayer.get_mask_background()]
+                    selectedLayer.remove_mask()
+                    selectedLayer.add_mask(new_mask_background)
+            else:
+                selectedLayer.add_mask(mask_to_add)
 
-                
+            
 
     def add_black_mask_with_ao_generator(self):
         """Adds a black mask with an ambient occlusion generator to the currently selected layer."""
-        self.add_mask('Black')
-        
-        if self.current_stack:
-            current_layer = layerstack.get_selected_nodes(self.current_stack)
-            generator_resource = resource.search("s:starterassets u:generator n:Ambient Occlusion")[0]
-            
-            insertion_positions = [
-                layerstack.InsertPosition.inside_node(layer, layerstack.NodeStack.Mask)
-                for layer in current_layer
-            ]
-            for pos in insertion_positions:
-                layerstack.insert_generator_effect(pos, generator_resource.identifier())
+        self._add_black_mask_with_generator("s:starterassets u:generator n:Ambient Occlusion")
                 
 
     def add_black_mask_with_curvature_generator(self):
         """Adds a black mask with a curvature generator to the currently selected layer."""
-        self.add_mask('Black')
+        self._add_black_mask_with_generator("s:starterassets u:generator n:Curvature")
+
+
+    def _add_black_mask_with_generator(self, search_query):
+        """Adds a black mask with the generator found for the search query to the currently selected layer."""
         if self.current_stack:
-            current_layer = layerstack.get_selected_nodes(self.current_stack)
-            generator_resource = resource.search("s:starterassets u:generator n:Curvature")[0]
-            
-            insertion_positions = [
-                layerstack.InsertPosition.inside_node(layer, layerstack.NodeStack.Mask)
-                for layer in current_layer
-            ]
-            for pos in insertion_positions:
-                layerstack.insert_generator_effect(pos, generator_resource.identifier())
+            current_layer = self.layer_selection
+            # Nothing to mask, skip the mask and generator lookups
+            if not current_layer:
+                return
+
+            generator_identifier = self._get_generator_identifier(search_query)
+            if generator_identifier is None:
+                return
+
+            # Always start from a fresh mask, so the generator is not stacked over an existing mask content
+            self._add_mask_to(current_layer, 'Black', keep_same_color=False)
+
+            for layer in current_layer:
+                insertion_position = layerstack.InsertPosition.inside_node(layer, layerstack.NodeStack.Mask)
+                layerstack.insert_generator_effect(insertion_position, generator_identifier)
                 
                 
     
     #Delete Full Stack Content
     def delete_stack_content(self):
+        """Deletes all the root layers of the current stack in a single layer stack modification"""
         current_layers = self.stack_layers
-        for layer in current_layers:
-            layerstack.delete_node(layer)
+        with layerstack.ScopedModification("Delete stack content"):
+            # Bottom-up, so each deletion leaves the remaining layers in place
+            for layer in reversed(current_layers):
+                layerstack.delete_node(layer)
+
+        # The cached stack layers are no longer valid
+        self._invalidate_layer_cache()
             
\ No newline at end of file
@@ -0,0 +1,163 @@
+##########################################################################
+#
+# Copyright 2010-2024 Vincent GAULT - Adobe
+# All Rights Reserved.
+#
+##########################################################################
+
+
+"""
+This module contains the helpers shared by the VG plugins of
+Substance 3d Painter: lazy access to the vg_pt_utils modules and to the
+shared managers, and the plugins lifetime state.
+It keeps this state for every plugin, so it is never reloaded itself.
+"""
+__author__ = "Vincent GAULT - Adobe"
+
+
+
+# Modules Import
+import functools
+import importlib
+import os
+import sys
+
+from PySide2 import QtCore
+from substance_painter import ui, event
+
+
+# vg_pt_utils modules the plugins may reload, in reload order
+_RELOADABLE_MODULES_NAMES = ("vg_layerstack", "vg_export")
+
+# vg_pt_utils modules, indexed by their name, imported on first use
+_vg_modules = {}
+
+# Painter main window, fetched once per plugin session
+_main_window = None
+
+# Managers shared by the plugins, created on first use
+_stack_manager = None
+_exporter = None
+
+
+def vg_module(module_name):
+    """Returns the vg_pt_utils module of the given name, imported on first use"""
+    module = _vg_modules.get(module_name)
+    if module is None:
+        module = importlib.import_module(f"vg_pt_utils.{module_name}")
+        _vg_modules[module_name] = module
+    return module
+
+
+def changed_vg_modules():
+    """Returns the names of the imported vg_pt_utils modules whose source changed since they were loaded, in reload order"""
+    changed_modules = []
+    for module_name in _RELOADABLE_MODULES_NAMES:
+        # Modules never imported yet have nothing to reload
+        if f"vg_pt_utils.{module_name}" not in sys.modules:
+            continue
+        module = vg_module(module_name)
+        # Each module records its own source modification time when it is executed
+        if os.path.getmtime(module.__file__) != getattr(module, "_LOADED_MTIME", None):
+            changed_modules.append(module_name)
+    return changed_modules
+
+
+def reload_vg_modules(modules_names):
+    """Reloads the given vg_pt_utils modules, and drops the shared managers built from their previous classes"""
+    for module_name in modules_names:
+        importlib.reload(vg_module(module_name))
+    reset_managers()
+
+
+def get_main_window():
+    """Returns Painter main window, fetched on first use"""
+    global _main_window
+    if _main_window is None:
+        _main_window = ui.get_main_window()
+    return _main_window
+
+
+def reset_main_window():
+    """Drops the main window, so it is fetched again by the next plugin session"""
+    global _main_window
+    _main_window = None
+
+
+def get_stack_manager():
+    """Returns the shared stack manager, refreshed on the active stack and layer selection"""
+    global _stack_manager
+    if _stack_manager is None:
+        _stack_manager = vg_module("vg_layerstack").VG_StackManager()
+    else:
+        _stack_manager.refresh()
+    return _stack_manager
+
+
+def get_exporter():
+    """Returns the shared export manager, created on first use, so its export maps are reused across exports"""
+    global _exporter
+    if _exporter is None:
+        _exporter = vg_module("vg_export").VG_ExportManager()
+    return _exporter
+
+
+def reset_managers():
+    """Drops the shared stack and export managers, so no stale stack is kept once the project changes"""
+    global _stack_manager, _exporter
+    _stack_manager = None
+    _exporter = None
+
+
+
+class VG_PluginSession:
+    """
+    Lifetime state of a plugin: whether it is started, the UI elements it created,
+    and the project events dropping the shared managers while it runs.
+
+    Attributes:
+    active (bool): True between start() and close().
+    widgets (deque): UI elements added by the plugin, kept for cleanup.
+    delete_widget (callable): Removes one of the plugin UI elements.
+    """
+
+    __author__ = "Vincent GAULT - Adobe"
+
+    def __init__(self, widgets, delete_widget):
+        self.active = False
+        self.widgets = widgets
+        self.delete_widget = delete_widget
+        # Bound once, so every plugin has its own connection, which is disconnected with the very same callback
+        self._project_changed_callback = self._on_project_changed
+
+    def _on_project_changed(self, *args):
+        """Drops the shared managers, so no stale stack is kept once the project changes"""
+        reset_managers()
+
+    def start(self, build_ui):
+        """Marks the plugin as started, and queues build_ui once the event loop runs,
+        so the plugin starts without waiting for the widgets.
+        A plugin already started is closed first, so its UI and event listeners are never registered twice"""
+        if self.active:
+            self.close()
+        self.active = True
+        QtCore.QTimer.singleShot(0, functools.partial(self._build_ui_if_active, build_ui))
+        event.DISPATCHER.connect(event.ProjectOpened, self._project_changed_callback)
+        event.DISPATCHER.connect(event.ProjectAboutToClose, self._project_changed_callback)
+
+    def _build_ui_if_active(self, build_ui):
+        """Runs the build_ui queued by start, unless the plugin was closed or its UI built meanwhile"""
+        if self.active and not self.widgets:
+            build_ui()
+
+    def close(self):
+        """Marks the plugin as closed, removes each of its UI elements, and disconnects its event listeners"""
+        was_active = self.active
+        self.active = False
+        reset_main_window()
+        while self.widgets:
+            self.delete_widget(self.widgets.popleft())
+        if was_active:
+            event.DISPATCHER.disconnect(event.ProjectOpened, self._project_changed_callback)
+            event.DISPATCHER.disconnect(event.ProjectAboutToClose, self._project_changed_callback)
+        reset_managers()
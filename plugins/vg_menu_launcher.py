@@ -12,79 +12,117 @@ This module creates a menu to host various tools for Substance Painter.
 __author__ = "Vincent GAULT - Adobe"
 
 # Modules import
-from PySide2 import QtWidgets
-import importlib
-import os
+from PySide2 import QtCore
+from collections import deque
+import functools
 
 from substance_painter import ui, logging
-from vg_pt_utils import vg_export, vg_layerstack
+from vg_pt_utils import vg_plugin_utils
 
-plugin_menus_widgets = []
+plugin_menus_widgets = deque()
 """Keeps track of added UI elements for cleanup."""
 
+_session = vg_plugin_utils.VG_PluginSession(plugin_menus_widgets, ui.delete_ui_element)
+"""Menu plugin lifetime state, so a deferred menu build is skipped after shutdown."""
+
+def _deferred(function):
+    """Decorate a menu action so its work runs on the next event loop iteration, once the menu is closed."""
+    @functools.wraps(function)
+    def deferred_function():
+        QtCore.QTimer.singleShot(0, function)
+    return deferred_function
+
 ######## FILL LAYER FUNCTIONS ########
 
+@QtCore.Slot()
+@_deferred
 def new_fill_layer_base():
     """Create a new fill layer with Base Color activated."""
-    stack_manager = vg_layerstack.VG_StackManager()
-    stack_manager.add_layer('fill', active_channels=["BaseColor"])
+    stack_manager = vg_plugin_utils.get_stack_manager()
+    stack_manager.add_layer('fill', active_channels=["BaseColor"], skip_refresh=True)
 
+@QtCore.Slot()
+@_deferred
 def new_fill_layer_height():
     """Create a new fill layer with Height channel activated."""
-    stack_manager = vg_layerstack.VG_StackManager()
-    stack_manager.add_layer('fill', active_channels=["Height"])
+    stack_manager = vg_plugin_utils.get_stack_manager()
+    stack_manager.add_layer('fill', active_channels=["Height"], skip_refresh=True)
 
+@QtCore.Slot()
+@_deferred
 def new_fill_layer_all():
     """Create a new fill layer with all channels activated."""
-    stack_manager = vg_layerstack.VG_StackManager()
-    stack_manager.add_layer('fill')
+    stack_manager = vg_plugin_utils.get_stack_manager()
+    stack_manager.add_layer('fill', skip_refresh=True)
 
 ######## PAINT LAYER FUNCTIONS ########    
 
+@QtCore.Slot()
+@_deferred
 def new_paint_layer():
     """Create a new paint layer."""
-    stack_manager = vg_layerstack.VG_StackManager()
-    stack_manager.add_layer('paint')
+    stack_manager = vg_plugin_utils.get_stack_manager()
+    stack_manager.add_layer('paint', skip_refresh=True)
 
 ######## MASK FUNCTIONS ########
 
+@QtCore.Slot()
+@_deferred
 def add_mask():
     """Add a black mask to the selected layer."""
-    stack_manager = vg_layerstack.VG_StackManager()
+    stack_manager = vg_plugin_utils.get_stack_manager()
     stack_manager.add_mask()
 
+@QtCore.Slot()
+@_deferred
 def add_ao_mask():
     """Add a black mask with AO Generator."""
-    stack_manager = vg_layerstack.VG_StackManager()
+    stack_manager = vg_plugin_utils.get_stack_manager()
     stack_manager.add_black_mask_with_ao_generator()
 
+@QtCore.Slot()
+@_deferred
 def add_curvature_mask():
     """Add a black mask with Curvature Generator."""
-    stack_manager = vg_layerstack.VG_StackManager()
+    stack_manager = vg_plugin_utils.get_stack_manager()
     stack_manager.add_black_mask_with_curvature_generator()
 
 ################ GENERATE CONTENT FROM STACK #######################    
 
+@QtCore.Slot()
+@_deferred
 def create_layer_from_stack():
     """Generate a layer from the visible content in the stack."""
-    exporter_manager = vg_export.VG_ExportManager()
-    exported_textures = exporter_manager.export_active_texture_set()
-    exporter_manager.import_textures_to_layer(exported_textures)
+    vg_plugin_utils.vg_module("vg_export").create_layer_from_stack(exporter=vg_plugin_utils.get_exporter())
 
+@QtCore.Slot()
+@_deferred
 def flatten_stack():
     """Flatten the stack by exporting and importing textures."""
-    exporter_manager = vg_export.VG_ExportManager()
-    stack_manager = vg_layerstack.VG_StackManager()
-    exported_textures = exporter_manager.export_active_texture_set()
-    stack_manager.delete_stack_content()
-    exporter_manager.import_textures_to_layer(exported_textures)
+    vg_plugin_utils.vg_module("vg_export").create_layer_from_stack(flatten=True, exporter=vg_plugin_utils.get_exporter())
 
 ########################################################### 
 
+_MENU_ITEMS = (
+    ("New Paint Layer (Ctrl+P)", new_paint_layer),
+    ("New Fill Layer with Base Color (Ctrl+F)", new_fill_layer_base),
+    ("New Fill Layer with Height (Ctrl+Alt+F)", new_fill_layer_height),
+    ("New Fill Layer with All Channels (Ctrl+Shift+F)", new_fill_layer_all),
+    ("Add Mask to Selected Layer (Ctrl+M)", add_mask),
+    ("Add AO Generator Mask (Ctrl+Shift+M)", add_ao_mask),
+    ("Add Curvature Generator Mask (Ctrl+Alt+M)", add_curvature_mask),
+    ("Create New Layer from Visible Stack (Ctrl+Shift+G)", create_layer_from_stack),
+    ("Flatten Stack", flatten_stack),
+)
+"""Menu actions labels and callbacks, in menu order."""
+
 def create_menu():    
     """Create and populate the menu with actions."""
+    # Qt widgets are only needed once the menu is built, not when the plugin is scanned
+    from PySide2 import QtWidgets
+
     # Get the main window
-    main_window = ui.get_main_window()    
+    main_window = vg_plugin_utils.get_main_window()
 
     # Create a new menu
     vg_utilities_menu = QtWidgets.QMenu("VG Utilities", main_window)
@@ -92,43 +130,45 @@ def create_menu():
     plugin_menus_widgets.append(vg_utilities_menu)
 
     # Create actions
-    actions = {
-        "New Paint Layer (Ctrl+P)": new_paint_layer,
-        "New Fill Layer with Base Color (Ctrl+F)": new_fill_layer_base,
-        "New Fill Layer with Height (Ctrl+Alt+F)": new_fill_layer_height,
-        "New Fill Layer with All Channels (Ctrl+Shift+F)": new_fill_layer_all,
-        "Add Mask to Selected Layer (Ctrl+M)": add_mask,
-        "Add AO Generator Mask (Ctrl+Shift+M)": add_ao_mask,
-        "Add Curvature Generator Mask (Ctrl+Alt+M)": add_curvature_mask,
-        "Create New Layer from Visible Stack (Ctrl+Shift+G)": create_layer_from_stack,
-        "Flatten Stack": flatten_stack,
-    }
-
-    for text, func in actions.items():
-        action = QtWidgets.QAction(text, vg_utilities_menu)
-        action.triggered.connect(func)
-        vg_utilities_menu.addAction(action)
+    # addAction(text) creates the action already parented to the menu,
+    # actions are triggered from the GUI thread so they are connected directly
+    for text, func in _MENU_ITEMS:
+        vg_utilities_menu.addAction(text).triggered.connect(func, QtCore.Qt.DirectConnection)
 
 def start_plugin():
     """Called when the plugin is started."""
-    create_menu()
+    # Built once the event loop runs, so start_plugin returns without waiting for the widgets.
+    # The menu of a previous start is removed first, so actions are never registered twice
+    _session.start(create_menu)
     logging.info("VG Menu Activated") 
     
 
 def close_plugin():
     """Called when the plugin is stopped."""
     # Remove all added widgets from the UI.
-    for widget in plugin_menus_widgets:
-        ui.delete_ui_element(widget)
-    plugin_menus_widgets.clear()
+    _session.close()
     logging.info("VG Menu deactivated")  
 
 def reload_plugin():
-    """Reload plugin modules."""
-    importlib.reload(vg_layerstack)
-    importlib.reload(vg_export)
+    """Reload plugin modules whose source changed since they were loaded.
+    An active menu is closed first and rebuilt afterwards, so its actions use the reloaded modules."""
+    changed_modules = vg_plugin_utils.changed_vg_modules()
+    if not changed_modules:
+        return
+
+    menu_was_active = _session.active
+    if menu_was_active:
+        close_plugin()
+
+    vg_plugin_utils.reload_vg_modules(changed_modules)
+
+    if menu_was_active:
+        start_plugin()
 
 if __name__ == "__main__":
-    importlib.reload(vg_layerstack)
-    importlib.reload(vg_export)
+    import os
+
+    # Sibling modules are only reloaded while developing them
+    if os.environ.get("VG_DEV_RELOAD"):
+        reload_plugin()
     start_plugin()
@@ -32,147 +32,174 @@ __author__ = "Vincent GAULT - Adobe"
 
 # Modules import
 from PySide2 import QtWidgets, QtGui, QtCore
-import importlib
+from collections import deque
+import functools
 
-from substance_painter import ui, logging
-from vg_pt_utils import vg_export, vg_layerstack
+from substance_painter import logging
+from vg_pt_utils import vg_plugin_utils
 
-plugin_shortcuts_widgets = []
+plugin_shortcuts_widgets = deque()
 """Keeps track of added UI elements for cleanup"""
 
+_BANNER = "\n".join((
+    "Shortcut Launcher activated",
+    "---",
+    "Ctrl + P: New Paint layer",
+    "---",
+    "Ctrl + F: New Fill layer with Base Color activated",
+    "Ctrl + Alt + F: New Fill layer with Height activated",
+    "Ctrl + Shift + F: New Fill layer, all channels activated",
+    "---",
+    "Ctrl + M: Add black mask to selected layer",
+    "Ctrl + Shift + M: Add black mask with AO Generator",
+    "Ctrl + Alt + M: Add black mask with Curvature Generator",
+    "---",
+    "Ctrl + Shift + G: Generate layer from what's visible in Stack",
+))
+"""Startup message listing the shortcuts, logged in a single call"""
+
+_SHORTCUT_THROTTLE_MS = 150
+"""Delay in milliseconds after a shortcut is triggered, during which its repeated activations are ignored"""
+
+@functools.lru_cache(maxsize=None)
+def _key_sequence(key_sequence):
+    """Returns the QKeySequence of a key sequence string or code, parsed once per process."""
+    return QtGui.QKeySequence(key_sequence)
+
 # Create and connect a shortcut
-def create_shortcut(key_sequence, function):
-    """Creates a shortcut and connects it to a function."""
-    shortcut = QtWidgets.QShortcut(QtGui.QKeySequence(key_sequence), ui.get_main_window())
+def create_shortcut(key_sequence, function, parent=None):
+    """Creates a shortcut and connects it to a function.
+    key_sequence can be a QKeySequence, or a key sequence string or code parsed once and cached.
+    The main window is used as parent if none is given."""
+    if parent is None:
+        parent = vg_plugin_utils.get_main_window()
+    if not isinstance(key_sequence, QtGui.QKeySequence):
+        key_sequence = _key_sequence(key_sequence)
+    shortcut = QtWidgets.QShortcut(key_sequence, parent)
+    # Held keys don't repeat the action
+    shortcut.setAutoRepeat(False)
     plugin_shortcuts_widgets.append(shortcut)
-    shortcut.activated.connect(function)
+
+    # The function runs on the first activation, and the ones following it within the throttle interval are ignored,
+    # the timers are parented to the shortcut so they are all deleted together
+    throttle_timer = QtCore.QTimer(shortcut)
+    throttle_timer.setSingleShot(True)
+    throttle_timer.setInterval(_SHORTCUT_THROTTLE_MS)
+
+    # The function runs on the next event loop iteration, so Qt finishes the keypress and repaints first
+    run_timer = QtCore.QTimer(shortcut)
+    run_timer.setSingleShot(True)
+    run_timer.setInterval(0)
+
+    @QtCore.Slot()
+    def on_activated():
+        # Also ignored while a previous activation is waiting for its run
+        if throttle_timer.isActive() or run_timer.isActive():
+            return
+        run_timer.start()
+
+    @QtCore.Slot()
+    def run_function():
+        try:
+            function()
+        finally:
+            # Started once the function returns, so presses queued during a long handler are ignored too
+            throttle_timer.start()
+
+    # Shortcuts and timers are emitted from the GUI thread, so they are connected directly
+    run_timer.timeout.connect(run_function, QtCore.Qt.DirectConnection)
+    shortcut.activated.connect(on_activated, QtCore.Qt.DirectConnection)
     return shortcut
 
-######## FILL LAYER SHORTCUTS (F) ########
-
-def on_ctrl_plus_f_shortcut_activated():
-    """Creates a new fill layer with the Base Color channel activated."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_layer('fill', active_channels=["BaseColor"])
-    except Exception as e:
-        logging.error(f"Failed to add fill layer with Base Color: {e}")
-
-def on_ctrl_plus_alt_plus_f_shortcut_activated():
-    """Creates a new fill layer with the Height channel activated."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_layer('fill', active_channels=["Height"])
-    except Exception as e:
-        logging.error(f"Failed to add fill layer with Height: {e}")
-
-def on_ctrl_plus_shift_plus_f_shortcut_activated():
-    """Creates a new fill layer with all channels activated."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_layer('fill')
-    except Exception as e:
-        logging.error(f"Failed to add fill layer with all channels: {e}")
-
-######## PAINT LAYER SHORTCUTS (P) ########
-
-def on_ctrl_plus_p_shortcut_activated():
-    """Creates a new paint layer."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_layer('paint')
-    except Exception as e:
-        logging.error(f"Failed to add paint layer: {e}")
-
-######## MASK SHORTCUTS (M) ########
-
-def on_ctrl_plus_m_shortcut_activated():
-    """Adds a black mask to the selected layer."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_mask()
-    except Exception as e:
-        logging.error(f"Failed to add black mask: {e}")
-
-def on_ctrl_plus_shift_plus_m_shortcut_activated():
-    """Adds a black mask with AO Generator to the selected layer."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_black_mask_with_ao_generator()
-    except Exception as e:
-        logging.error(f"Failed to add black mask with AO Generator: {e}")
-
-def on_ctrl_plus_alt_plus_m_shortcut_activated():
-    """Adds a black mask with Curvature Generator to the selected layer."""
-    try:
-        stack_manager = vg_layerstack.VG_StackManager()
-        stack_manager.add_black_mask_with_curvature_generator()
-    except Exception as e:
-        logging.error(f"Failed to add black mask with Curvature Generator: {e}")
+def _safe(error_message):
+    """Decorates a shortcut handler as a Qt slot, logging error_message if it fails."""
+    def decorator(function):
+        @QtCore.Slot()
+        @functools.wraps(function)
+        def safe_function():
+            try:
+                function()
+            except Exception as e:
+                logging.error(f"{error_message}: {e}")
+        return safe_function
+    return decorator
+
+######## STACK SHORTCUTS ########
+
+def _make_handler(error_message, method_name, *args, **kwargs):
+    """Returns a shortcut handler calling a method of the shared stack manager, logging error_message if it fails."""
+    @_safe(error_message)
+    def handler():
+        getattr(vg_plugin_utils.get_stack_manager(), method_name)(*args, **kwargs)
+    return handler
 
 ######## GENERATE LAYER SHORTCUT ########
 
+@_safe("Failed to generate layer from visible content")
 def on_ctrl_plus_shift_plus_g_shortcut_activated():
     """Generates a layer from the visible content in the stack."""
-    try:
-        exporter_manager = vg_export.VG_ExportManager()
-        exported_textures = exporter_manager.export_active_texture_set()
-        exporter_manager.import_textures_to_layer(exported_textures)
-    except Exception as e:
-        logging.error(f"Failed to generate layer from visible content: {e}")
+    vg_plugin_utils.vg_module("vg_export").create_layer_from_stack(exporter=vg_plugin_utils.get_exporter())
+
+_SHORTCUT_TABLE = (
+    # Fill layers (F)
+    ("Ctrl+F", _make_handler("Failed to add fill layer with Base Color",
+                             "add_layer", 'fill', active_channels=["BaseColor"], skip_refresh=True)),
+    ("Ctrl+Alt+F", _make_handler("Failed to add fill layer with Height",
+                                 "add_layer", 'fill', active_channels=["Height"], skip_refresh=True)),
+    ("Ctrl+Shift+F", _make_handler("Failed to add fill layer with all channels",
+                                   "add_layer", 'fill', skip_refresh=True)),
+    # Paint layers (P)
+    ("Ctrl+P", _make_handler("Failed to add paint layer", "add_layer", 'paint', skip_refresh=True)),
+    # Masks (M)
+    ("Ctrl+M", _make_handler("Failed to add black mask", "add_mask")),
+    ("Ctrl+Shift+M", _make_handler("Failed to add black mask with AO Generator",
+                                   "add_black_mask_with_ao_generator")),
+    ("Ctrl+Alt+M", _make_handler("Failed to add black mask with Curvature Generator",
+                                 "add_black_mask_with_curvature_generator")),
+    # Generate layer (G)
+    ("Ctrl+Shift+G", on_ctrl_plus_shift_plus_g_shortcut_activated),
+)
+"""Shortcuts key sequences, given as strings parsed by QKeySequence, and their callbacks"""
 
 def define_shortcuts():
     """Defines the various keyboard shortcuts."""
-    hidden_window = QtWidgets.QWidget()
-    plugin_shortcuts_widgets.append(hidden_window)
-
-    shortcuts = {
-        QtCore.Qt.CTRL + QtCore.Qt.Key_F: on_ctrl_plus_f_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.ALT + QtCore.Qt.Key_F: on_ctrl_plus_alt_plus_f_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.SHIFT + QtCore.Qt.Key_F: on_ctrl_plus_shift_plus_f_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.Key_P: on_ctrl_plus_p_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.Key_M: on_ctrl_plus_m_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.SHIFT + QtCore.Qt.Key_M: on_ctrl_plus_shift_plus_m_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.ALT + QtCore.Qt.Key_M: on_ctrl_plus_alt_plus_m_shortcut_activated,
-        QtCore.Qt.CTRL + QtCore.Qt.SHIFT + QtCore.Qt.Key_G: on_ctrl_plus_shift_plus_g_shortcut_activated,
-    }
+    main_window = vg_plugin_utils.get_main_window()
+    for key_sequence, function in _SHORTCUT_TABLE:
+        create_shortcut(key_sequence, function, main_window)
 
-    for key_sequence, function in shortcuts.items():
-        create_shortcut(key_sequence, function)
+def _delete_shortcut(widget):
+    """Disables and deletes a shortcut, which is parented to the main window, not added as a Painter UI element."""
+    if widget is not None:
+        widget.setEnabled(False)
+        widget.deleteLater()
 
-    ui.add_dock_widget(hidden_window)
+_session = vg_plugin_utils.VG_PluginSession(plugin_shortcuts_widgets, _delete_shortcut)
+"""Shortcuts plugin lifetime state, so deferred shortcuts are not defined after shutdown"""
 
 def start_plugin():
     """This function is called when the plugin is started."""
-    define_shortcuts()
-    logging.info("Shortcut Launcher activated")
-    logging.info("---")
-    logging.info("Ctrl + P: New Paint layer")
-    logging.info("---")
-    logging.info("Ctrl + F: New Fill layer with Base Color activated")
-    logging.info("Ctrl + Alt + F: New Fill layer with Height activated")
-    logging.info("Ctrl + Shift + F: New Fill layer, all channels activated")
-    logging.info("---")
-    logging.info("Ctrl + M: Add black mask to selected layer")
-    logging.info("Ctrl + Shift + M: Add black mask with AO Generator")
-    logging.info("Ctrl + Alt + M: Add black mask with Curvature Generator")
-    logging.info("---")
-    logging.info("Ctrl + Shift + G: Generate layer from what's visible in Stack")
+    # Defined once the event loop runs, so start_plugin returns without waiting for the widgets.
+    # The shortcuts of a previous start are deleted first, so they are never registered twice
+    _session.start(define_shortcuts)
+    logging.info(_BANNER)
 
 def close_plugin():
     """This function is called when the plugin is stopped."""
-    for widget in plugin_shortcuts_widgets:
-        if widget is not None:
-            ui.delete_ui_element(widget)
-    plugin_shortcuts_widgets.clear()
+    _session.close()
     logging.info("Shortcut Launcher deactivated")
 
 def reload_plugin():
-    """Reloads the plugin modules."""
-    importlib.reload(vg_layerstack)
-    importlib.reload(vg_export)
+    """Reloads the plugin modules whose source changed since they were loaded."""
+    changed_modules = vg_plugin_utils.changed_vg_modules()
+    if not changed_modules:
+        return
+
+    vg_plugin_utils.reload_vg_modules(changed_modules)
 
 if __name__ == "__main__":
-    importlib.reload(vg_layerstack)
-    importlib.reload(vg_export)
+    import os
+
+    # Sibling modules are only reloaded while developing them
+    if os.environ.get("VG_DEV_RELOAD"):
+        reload_plugin()
     start_plugin()